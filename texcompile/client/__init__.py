@@ -1,32 +1,84 @@
-import base64
+import binascii
+import functools
+import importlib
+import ipaddress
+import itertools
+import json
 import logging
 import os
 import os.path
 import posixpath
-import tarfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from io import BytesIO
-from sys import platform
-from typing import Dict, List
+from types import ModuleType
+from typing import (
+    TYPE_CHECKING, Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union,
+)
+from urllib.parse import urlsplit
 import time
 
-import requests
 from typing_extensions import Literal
 
+# Modules that only the remote compilation path needs ('requests', 'tarfile', 'ijson' and the
+# optional accelerators below) are imported where they are used, so that importing this
+# package (e.g., only for 'compile_pdf_locally') does not pay for them.
+if TYPE_CHECKING:
+    import tarfile
+
+    import requests
+
 logger = logging.getLogger("texcompile-client")
 
-if platform == "linux" or platform == "linux2":
-    try:
-        from memory_tempfile import MemoryTempfile
-        tempfile = MemoryTempfile()
-    except:
-        import tempfile
-else:
-    import tempfile
+# JSON responses up to this size are parsed in one go; larger ones are streamed with ijson.
+MAX_BUFFERED_JSON_SIZE = 16 * 1024 * 1024
+
+ARCHIVE_FILENAMES = {None: "archive.tar", "gz": "archive.tgz", "zst": "archive.tar.zst"}
+
+# Response header in which the service lists the archive compressions it can unpack.
+ARCHIVE_FORMATS_HEADER = "X-Texcompile-Archive-Formats"
+
+# Archive formats each endpoint advertised in its last response. Endpoints are sent gzip until
+# they advertise something else, so servers that predate uncompressed or zstd uploads (e.g., an
+# old local Docker image) keep working.
+_endpoint_archive_formats: Dict[str, Set[str]] = {}
+
+# Top-level fields of a compilation result that the client relies on.
+REQUIRED_RESULT_KEYS = ("success", "has_output", "log", "main_tex_files")
+
+# Number of base64 characters decoded per chunk by the stdlib fallback. Must be a multiple of 4.
+_B64_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Retries for the server's 104 (connection reset) responses, with exponential backoff.
+MAX_REQUEST_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 0.1
+MAX_RETRY_BACKOFF_SECONDS = 2.0
+
+# Connections to the compilation service are pooled and kept alive across requests.
+CONNECTION_POOL_SIZE = 32
+
 
 Path = str
 
 
+@functools.lru_cache(maxsize=None)
+def _optional_module(name: str) -> Optional[ModuleType]:
+    """
+    Import an optional accelerator module ('pybase64', 'orjson', 'zstandard') on first use.
+    Returns None if it is not installed.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+def _json_loads(document: bytes) -> Any:
+    # orjson parses large JSON documents several times faster than the stdlib module.
+    orjson = _optional_module("orjson")
+    return orjson.loads(document) if orjson is not None else json.loads(document)
+
+
 class ServerConnectionException(Exception):
     pass
 
@@ -59,32 +111,296 @@ class Result:
         )
 
 
-def send_request(sources_dir, host, port, autotex_or_latexml, main_tex=' ') -> dict:
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Prepare a gzipped tarball file containing the sources.
-        archive_filename = os.path.join(temp_dir, "archive.tgz")
-        with tarfile.open(archive_filename, "w:gz") as archive:
-            archive.add(sources_dir, arcname=os.path.sep)
-
-        # Prepare query parameters.
-        with open(archive_filename, "rb") as archive_file:
-            files = {"sources": ("archive.tgz", archive_file, "multipart/form-data")}
-            data = {"autotex_or_latexml": autotex_or_latexml, "main_tex_file": main_tex}
-            if autotex_or_latexml == "latexml":
-                assert main_tex, "No main .tex file specified."
-            # Make request to service.
-            endpoint = f"{host}:{port}/"
-            try:
-                response = requests.post(endpoint, files=files, data=data)
-                while response.status_code == 104:
-                    response = requests.post(endpoint, files=files, data=data)
-            except requests.exceptions.RequestException as e:
-                raise ServerConnectionException(
-                    f"Request to server {endpoint} failed.", e
-                )
+def _write_b64(base64_contents: str, file_: BinaryIO) -> None:
+    """
+    Decode base64 contents straight into a binary file object, so that the decoded buffer is the
+    only full-size copy of the output that is held in memory.
+    """
+    pybase64 = _optional_module("pybase64")
+    if pybase64 is not None:
+        # pybase64 wraps libbase64's SIMD kernels.
+        file_.write(pybase64.b64decode_as_bytearray(base64_contents, validate=False))
+        return
+    for start in range(0, len(base64_contents), _B64_CHUNK_SIZE):
+        file_.write(binascii.a2b_base64(base64_contents[start : start + _B64_CHUNK_SIZE]))
+
+
+def _write_contents(contents: Union[str, bytes], file_: BinaryIO) -> None:
+    """
+    Write the contents of an output file. Contents are raw bytes if the server sent them as
+    binary parts, or a base64 string if they were embedded in a JSON response (older servers).
+    """
+    if isinstance(contents, str):
+        _write_b64(contents, file_)
+    else:
+        file_.write(contents)
+
+
+def _decode_contents(contents: Union[str, bytes]) -> bytes:
+    """
+    Return the contents of an output file as bytes (see '_write_contents'). Raw bytes are
+    returned as is. The result can be wrapped in a BytesIO without copying it again.
+    """
+    if not isinstance(contents, str):
+        return contents
+    pybase64 = _optional_module("pybase64")
+    if pybase64 is not None:
+        return pybase64.b64decode(contents, validate=False)
+    return binascii.a2b_base64(contents)
+
+
+# Files in a source tree that the server never needs: VCS / OS / Python clutter and TeX
+# by-products that compilation regenerates anyway. PDFs are kept, as they are often figures.
+EXCLUDED_SOURCE_NAMES = {".git", ".svn", "__pycache__", ".DS_Store"}
+EXCLUDED_SOURCE_SUFFIXES = (".aux", ".log", ".out", ".synctex.gz", ".pyc")
+
+
+def _source_filter(tarinfo: "tarfile.TarInfo") -> Optional["tarfile.TarInfo"]:
+    name = tarinfo.name.rsplit("/", 1)[-1]
+    if name in EXCLUDED_SOURCE_NAMES or name.lower().endswith(EXCLUDED_SOURCE_SUFFIXES):
+        return None
+    return tarinfo
+
+
+def _is_loopback_host(host: str) -> bool:
+    hostname = urlsplit(host).hostname or host
+    if hostname == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(hostname).is_loopback
+    except ValueError:
+        return False
+
+
+def _build_archive(sources_dir: Path, compression: Optional[str]) -> Tuple[str, BytesIO]:
+    """
+    Build a tarball of the sources in memory, compressed with 'compression' (None, "gz" or
+    "zst"). Returns the archive's file name and its contents, rewound to the start.
+    """
+    import tarfile
+
+    archive_buffer = BytesIO()
+    if compression == "gz":
+        archive = tarfile.open(fileobj=archive_buffer, mode="w:gz", compresslevel=1)
+    else:
+        archive = tarfile.open(fileobj=archive_buffer, mode="w")
+    with archive:
+        archive.add(sources_dir, arcname=os.path.sep, filter=_source_filter)
+    if compression == "zst":
+        compressor = _optional_module("zstandard").ZstdCompressor(level=3, threads=-1)
+        archive_buffer = BytesIO(compressor.compress(archive_buffer.getvalue()))
+    archive_buffer.seek(0)
+    return ARCHIVE_FILENAMES[compression], archive_buffer
+
+
+@functools.lru_cache(maxsize=None)
+def _get_session() -> "requests.Session":
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    for prefix in ("http://", "https://"):
+        session.mount(
+            prefix,
+            HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE),
+        )
+    return session
+
+
+def _post_with_retries(
+    endpoint: str, archive_name: str, archive_buffer: BytesIO, data: Dict[str, str]
+) -> "requests.Response":
+    import requests
+
+    files = {"sources": (archive_name, archive_buffer, "multipart/form-data")}
+    # Ask for output files as binary parts. Servers that predate this fall back to JSON.
+    headers = {"Accept": "multipart/mixed, application/json"}
+    for attempt in range(MAX_REQUEST_ATTEMPTS):
+        if attempt > 0:
+            time.sleep(min(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1), MAX_RETRY_BACKOFF_SECONDS))
+        # Upload the archive from the start, also when it is sent again.
+        archive_buffer.seek(0)
+        try:
+            response = _get_session().post(
+                endpoint, files=files, data=data, headers=headers, stream=True
+            )
+        except requests.exceptions.RequestException as e:
+            raise ServerConnectionException(
+                f"Request to server {endpoint} failed.", e
+            )
+        if response.status_code != 104:
+            return response
+        response.close()
+    raise ServerConnectionException(
+        f"Request to server {endpoint} failed after {MAX_REQUEST_ATTEMPTS} attempts."
+    )
 
-    # Get result
-    return response.json()
+
+def send_request(
+    sources_dir, host, port, autotex_or_latexml, main_tex=' '
+) -> "requests.Response":
+    """
+    Upload the sources to the compilation service. The response is returned unread (it was
+    requested with stream=True), so the caller should use it as a context manager and read the
+    body with '_read_result'.
+    """
+    endpoint = f"{host}:{port}/"
+
+    # Compression only pays off when the upload goes over a real network; over loopback it is
+    # pure CPU overhead. zstd compresses much faster than gzip at a similar ratio. Each format is
+    # only used once the server has said that it can read it.
+    archive_formats = _endpoint_archive_formats.get(endpoint, set())
+    if _is_loopback_host(host) and "tar" in archive_formats:
+        compression = None
+    elif _optional_module("zstandard") is not None and "zst" in archive_formats:
+        compression = "zst"
+    else:
+        compression = "gz"
+    archive_name, archive_buffer = _build_archive(sources_dir, compression)
+
+    # Prepare query parameters.
+    data = {"autotex_or_latexml": autotex_or_latexml, "main_tex_file": main_tex}
+    if autotex_or_latexml == "latexml":
+        assert main_tex, "No main .tex file specified."
+    # Make request to service.
+    response = _post_with_retries(endpoint, archive_name, archive_buffer, data)
+    if compression == "zst" and response.status_code == 415:
+        logger.warning("Server %s cannot read zstd archives. Retrying with gzip.", endpoint)
+        response.close()
+        archive_name, archive_buffer = _build_archive(sources_dir, "gz")
+        response = _post_with_retries(endpoint, archive_name, archive_buffer, data)
+    _endpoint_archive_formats[endpoint] = {
+        f.strip() for f in response.headers.get(ARCHIVE_FORMATS_HEADER, "").split(",")
+    }
+
+    # Fail fast on error pages, before anything tries to parse them as a compilation result.
+    if not response.ok:
+        with response:
+            raise ServerConnectionException(
+                f"Request to server {endpoint} failed with HTTP {response.status_code}: "
+                + response.text[:500]
+            )
+    content_type = response.headers.get("Content-Type", "")
+    if not content_type.startswith(("multipart/", "application/json")):
+        response.close()
+        raise ServerConnectionException(
+            f"Unexpected response from server {endpoint} (Content-Type: {content_type!r})."
+        )
+
+    return response
+
+
+def _build_value(first_event: Tuple[str, str, Any], events: Iterator[Tuple[str, str, Any]]) -> Any:
+    """
+    Assemble one JSON value from a stream of ijson events, starting at 'first_event' and
+    consuming only the events that belong to that value.
+    """
+    from ijson.common import ObjectBuilder
+
+    builder = ObjectBuilder()
+    depth = 0
+    for _, event, value in itertools.chain([first_event], events):
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+
+
+def _iter_outputs(events: Iterator[Tuple[str, str, Any]]) -> Iterator[Dict[str, Any]]:
+    # Skip the event that opens the 'output' array. If there was no 'output' key, the event
+    # stream has already been exhausted.
+    if next(events, None) is None:
+        return
+    for event in events:
+        if event[1] == "end_array":
+            return
+        yield _build_value(event, events)
+
+
+def _missing_result_keys(data: Dict[str, Any]) -> List[str]:
+    return [key for key in REQUIRED_RESULT_KEYS if key not in data]
+
+
+def _read_multipart_result(
+    response: "requests.Response",
+) -> Tuple[Dict[str, Any], Iterator[Dict[str, Any]]]:
+    """
+    Parse a 'multipart/mixed' response from the compilation service. The first part is the JSON
+    result without output contents, and each following part holds the raw bytes of the entry
+    at the same position in "output".
+    """
+    from requests_toolbelt.multipart.decoder import MultipartDecoder
+
+    decoder = MultipartDecoder(response.content, response.headers["Content-Type"])
+    metadata, *file_parts = decoder.parts
+    data = _json_loads(metadata.content)
+    outputs = data.pop("output")
+    if len(file_parts) != len(outputs):
+        raise ServerConnectionException(
+            f"Response from server {response.url} has {len(file_parts)} file parts for "
+            + f"{len(outputs)} outputs."
+        )
+    for output, part in zip(outputs, file_parts):
+        output["contents"] = part.content
+    return data, iter(outputs)
+
+
+def _read_json_result(
+    response: "requests.Response",
+) -> Tuple[Dict[str, Any], Iterator[Dict[str, Any]]]:
+    """
+    Parse the JSON body of a response from the compilation service. Bodies of known, moderate
+    size are read and parsed in one go. Otherwise the body is parsed incrementally: all
+    top-level fields that precede "output" (the server always writes it last) are read right
+    away, and the entries of "output" are only parsed as the returned iterator is advanced, so
+    at most one base64-encoded output is held in memory at a time.
+    """
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None and int(content_length) <= MAX_BUFFERED_JSON_SIZE:
+        data = _json_loads(response.content)
+        return data, iter(data.pop("output", []))
+
+    import ijson
+
+    response.raw.decode_content = True
+    events = ijson.parse(response.raw)
+    data: Dict[str, Any] = {}
+    for prefix, event, value in events:
+        if prefix == "" and event == "map_key":
+            if value == "output":
+                break
+            data[value] = _build_value(next(events), events)
+
+    # Only the fields written before "output" have been read, so a server that orders its
+    # fields differently shows up here rather than as a KeyError further on.
+    missing_keys = _missing_result_keys(data)
+    if missing_keys:
+        raise ServerConnectionException(
+            f"Response from server {response.url} is missing {', '.join(missing_keys)} "
+            + "before \"output\"."
+        )
+    return data, _iter_outputs(events)
+
+
+def _read_result(response: "requests.Response") -> Tuple[Dict[str, Any], Iterator[Dict[str, Any]]]:
+    """
+    Read a response from the compilation service into its top-level fields and an iterator over
+    its output files, whose "contents" can be written out with '_write_contents'.
+    """
+    if response.headers.get("Content-Type", "").startswith("multipart/"):
+        data, outputs = _read_multipart_result(response)
+    else:
+        data, outputs = _read_json_result(response)
+
+    missing_keys = _missing_result_keys(data)
+    if missing_keys:
+        raise ServerConnectionException(
+            f"Response from server {response.url} is missing {', '.join(missing_keys)}."
+        )
+    return data, outputs
 
 
 def compile_pdf(
@@ -94,65 +410,99 @@ def compile_pdf(
     port: int = 8000,
 ) -> Result:
 
-    data = send_request(sources_dir, host, port, "autotex")
+    with send_request(sources_dir, host, port, "autotex") as response:
+        data, outputs = _read_result(response)
 
-    # Check success.
-    if not (data["success"] or data["has_output"]):
-        raise CompilationException(data["log"])
+        # Check success.
+        if not (data["success"] or data["has_output"]):
+            raise CompilationException(data["log"])
 
-    output_files: List[OutputFile] = []
-    result = Result(
-        success=data["success"],
-        main_tex_files=data["main_tex_files"],
-        log=data["log"],
-        output_files=output_files,
-    )
+        output_files: List[OutputFile] = []
+        result = Result(
+            success=data["success"],
+            main_tex_files=data["main_tex_files"],
+            log=data["log"],
+            output_files=output_files,
+        )
 
-    # Save outputs to output directory, and create manifest of output files.
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    for i, output in enumerate(data["output"]):
-        type_ = output["type"]
-        # Use posixpath to get the base name, with the assumption that the TeX server will be
-        # returning paths to compiled files in POSIX style (rather than, say, Windows).
-        basename = posixpath.basename(output["path"])
-        output_files.append(OutputFile(type_, basename))
-
-        # Save output file to the filesystem.
-        save_path = os.path.join(output_dir, basename)
-        if os.path.exists(save_path):
-            logger.warning(
-                "File already exists at %s. The old file will be overwritten.",
-                save_path,
-            )
-        base64_contents = output["contents"]
-        contents = base64.b64decode(base64_contents)
-        with open(save_path, "wb") as file_:
-            file_.write(contents)
+        # Save outputs to output directory, and create manifest of output files.
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        output_dir_prefix = os.path.join(output_dir, "")
+        for i, output in enumerate(outputs):
+            type_ = output["type"]
+            # Use posixpath to get the base name, with the assumption that the TeX server will be
+            # returning paths to compiled files in POSIX style (rather than, say, Windows).
+            basename = posixpath.basename(output["path"])
+            output_files.append(OutputFile(type_, basename))
+
+            # Save output file to the filesystem. Creating it exclusively saves a separate
+            # existence check in the common case where there is no old file.
+            save_path = output_dir_prefix + basename
+            try:
+                file_ = open(save_path, "xb")
+            except FileExistsError:
+                logger.warning(
+                    "File already exists at %s. The old file will be overwritten.",
+                    save_path,
+                )
+                file_ = open(save_path, "wb")
+            with file_:
+                _write_contents(output["contents"], file_)
 
     return result
 
 
+def compile_pdf_batch(
+    sources_dirs: Sequence[Path],
+    output_dirs: Sequence[Path],
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    max_workers: int = 8,
+) -> List[Union[Result, Exception]]:
+    """
+    Compile several TeX projects concurrently with 'compile_pdf', saving the outputs of each
+    project to its own directory in 'output_dirs' (most projects produce e.g. 'main.pdf', so
+    outputs cannot share a directory). Returns one item per project, in the order of
+    'sources_dirs': its Result, or the exception raised while compiling it, so that one failed
+    project does not discard the others. The client mostly waits on the network, so threads
+    sharing the pooled session are enough to keep the server busy.
+    """
+    if len(output_dirs) != len(sources_dirs):
+        raise ValueError("Expected one output directory per sources directory.")
+    if len({os.path.abspath(d) for d in output_dirs}) != len(output_dirs):
+        raise ValueError("Output directories must be distinct.")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(compile_pdf, sources_dir, output_dir, host=host, port=port)
+            for sources_dir, output_dir in zip(sources_dirs, output_dirs)
+        ]
+    return [future.exception() or future.result() for future in futures]
+
+
 def compile_pdf_return_bytes(
     sources_dir: Path,
     host: str = "http://127.0.0.1",
     port: int = 8000,
 ) -> Result:
-    
-    data = send_request(sources_dir, host, port, "autotex")
 
-    # Check success.
-    if not (data["success"] or data["has_output"]):
-        raise CompilationException(data["log"])
+    with send_request(sources_dir, host, port, "autotex") as response:
+        data, outputs = _read_result(response)
 
-    for i, output in enumerate(data["output"]):
-        type_ = output["type"]
-        if type_ == 'pdf':
-            basename = posixpath.basename(output["path"])
-            base64_contents = output["contents"]
-            contents = base64.b64decode(base64_contents)
-            return basename, BytesIO(contents)
+        # Check success.
+        if not (data["success"] or data["has_output"]):
+            raise CompilationException(data["log"])
+
+        for i, output in enumerate(outputs):
+            type_ = output["type"]
+            if type_ == 'pdf':
+                # Only the first PDF is needed. Stop reading the response so that any outputs
+                # after it are never parsed.
+                response.close()
+                basename = posixpath.basename(output["path"])
+                return basename, BytesIO(_decode_contents(output["contents"]))
 
     raise CompilationException('No pdf output.')
     
@@ -162,18 +512,18 @@ def compile_html_return_text(
     host: str = "http://127.0.0.1",
     port: int = 8000,
 ) -> str:
-    data = send_request(sources_dir, host, port, "latexml", main_tex)
-
-    # Check success.
-    if not (data["success"] or data["has_output"]):
-        raise CompilationException(data["log"])
-
-    for i, output in enumerate(data["output"]):
-        type_ = output["type"]
-        if type_ == 'html':
-            base64_contents = output["contents"]
-            contents = base64.b64decode(base64_contents).decode("utf-8")
-            return contents
+    with send_request(sources_dir, host, port, "latexml", main_tex) as response:
+        data, outputs = _read_result(response)
+
+        # Check success.
+        if not (data["success"] or data["has_output"]):
+            raise CompilationException(data["log"])
+
+        for i, output in enumerate(outputs):
+            type_ = output["type"]
+            if type_ == 'html':
+                response.close()
+                return _decode_contents(output["contents"]).decode("utf-8")
 
     raise CompilationException('No pdf output.')
 
@@ -1,45 +1,106 @@
+import logging
+import mmap
 import subprocess
 import os
 import shutil
+import sys
 import tempfile
-import re
 from io import BytesIO
-from typing import Tuple
+from typing import Tuple, Union
 
-# --- 環境に合わせて設定する定数 ---
+# FICLONE による reflink は Linux でのみ試す（fcntl は Windows には存在しない）
+if sys.platform.startswith("linux"):
+    import fcntl
+else:
+    fcntl = None
+
+logger = logging.getLogger("texcompile-client")
+
+# --- 環境に合わせて設定する定数（同名の環境変数があればそちらを使う。インポート時に一度だけ解決する） ---
 # 【修正箇所】呼び出すべきPerlのフルパスを明示的に指定
-PERL_BINARY_PATH = "/usr/bin/perl"
-PERL_SCRIPT_PATH = "/TEX/texannotate/texcompile/service/run_autotex.pl"
-TEXLIVE_PATH = "/usr/local/texlive/2025"
-TEXLIVE_BIN_PATH = "/usr/local/texlive/2025/bin/x86_64-linux"
+PERL_BINARY_PATH = os.environ.get("PERL_BINARY_PATH", "/usr/bin/perl")
+PERL_SCRIPT_PATH = os.environ.get(
+    "PERL_SCRIPT_PATH", "/TEX/texannotate/texcompile/service/run_autotex.pl"
+)
+TEXLIVE_PATH = os.environ.get("TEXLIVE_PATH", "/usr/local/texlive/2025")
+TEXLIVE_BIN_PATH = os.environ.get(
+    "TEXLIVE_BIN_PATH", "/usr/local/texlive/2025/bin/x86_64-linux"
+)
 # ------------------------------------
 
+PDF_MESSAGE_PREFIX = b"Generated PDF: "
+PDF_MESSAGE_SUFFIX = b"<end of PDF name>"
+# run_autotex.pl は生成したPDF名をログの最後に出力するので、末尾だけを探せば十分
+STDOUT_TAIL_SIZE = 64 * 1024
+
+# AutoTeX はコンパイル前にソースの権限が 0777 か 0775 であることを要求する
+COMPILATION_PERMISSIONS = 0o775
+
+# linux/fs.h の FICLONE ioctl（btrfs / xfs などで reflink を作成する）
+FICLONE = 0x40049409
+
 class LocalCompilationException(Exception):
     """ローカルでのコンパイル失敗を示すカスタム例外"""
     pass
 
-def compile_pdf_locally(sources_dir: str) -> Tuple[str, BytesIO]:
+def _fast_clone(src: str, dst: str) -> None:
+    """
+    ファイルを複製する。reflink（コピーオンライト）→ os.copy_file_range によるカーネル内コピー
+    → 通常のコピーの順に試す。ハードリンクはコンパイル中の上書きや権限変更が元のソースに
+    及んでしまうため使わない。
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+                    pass
+                return
+            except OSError:
+                # 途中まで書き込まれている可能性があるので最初からやり直す
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def _clone_tree(src_dir: str, dst_dir: str) -> None:
+    """src_dir の中身を既存の dst_dir に複製し、複製したものの権限を 775 にする"""
+    with os.scandir(src_dir) as entries:
+        for entry in entries:
+            d = os.path.join(dst_dir, entry.name)
+            if entry.is_dir():
+                os.mkdir(d)
+                _clone_tree(entry.path, d)
+            else:
+                _fast_clone(entry.path, d)
+            try:
+                os.chmod(d, COMPILATION_PERMISSIONS)
+            except OSError as e:
+                raise LocalCompilationException(f"権限の変更に失敗しました: {e}")
+
+
+def compile_pdf_locally(sources_dir: str) -> Tuple[str, Union[mmap.mmap, BytesIO]]:
     """
     指定されたソースディレクトリのTeXプロジェクトをローカル環境でコンパイルし、
-    結果のPDFの (ファイル名, BytesIOオブジェクト) を返す。
-    （関数の他の部分は変更ありません）
+    結果のPDFの (ファイル名, 読み取り専用の mmap オブジェクト) を返す。
+    POSIX 以外ではマップしたファイルを削除できないため、代わりに BytesIO を返す。
+    どちらも read / seek / tell などのファイル風APIを持つ。
     """
     if not os.path.isdir(sources_dir):
         raise FileNotFoundError(f"指定されたソースディレクトリが見つかりません: {sources_dir}")
 
     with tempfile.TemporaryDirectory() as temp_dir:
-        # ... (ソースのコピーと権限変更のコードはそのまま) ...
-        for item in os.listdir(sources_dir):
-            s = os.path.join(sources_dir, item)
-            d = os.path.join(temp_dir, item)
-            if os.path.isdir(s):
-                shutil.copytree(s, d)
-            else:
-                shutil.copy2(s, d)
+        _clone_tree(sources_dir, temp_dir)
         try:
-            subprocess.run(["chmod", "-R", "775", temp_dir], check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            raise LocalCompilationException(f"権限の変更に失敗しました: {e.stderr.decode()}")
+            os.chmod(temp_dir, COMPILATION_PERMISSIONS)
+        except OSError as e:
+            raise LocalCompilationException(f"権限の変更に失敗しました: {e}")
         
         # 【修正箇所】コマンドの組み立て部分で、新しい定数を使う
         command = [
@@ -50,32 +111,45 @@ def compile_pdf_locally(sources_dir: str) -> Tuple[str, BytesIO]:
             TEXLIVE_BIN_PATH
         ]
 
-        print(f"実行コマンド: {' '.join(command)}")
+        logger.debug("実行コマンド: %s", command)
         try:
             result = subprocess.run(
                 command,
                 check=True,
                 capture_output=True,
-                text=True
             )
         except subprocess.CalledProcessError as e:
             error_message = (
                 f"Perlスクリプトの実行に失敗しました。\n"
-                f"--- STDOUT ---\n{e.stdout}\n"
-                f"--- STDERR ---\n{e.stderr}"
+                f"--- STDOUT ---\n{e.stdout.decode('utf-8', 'replace')}\n"
+                f"--- STDERR ---\n{e.stderr.decode('utf-8', 'replace')}"
             )
             raise LocalCompilationException(error_message)
 
         # ... (残りのコードはそのまま) ...
-        match = re.search(r"Generated PDF: (.*?)<end of PDF name>", result.stdout)
-        if not match:
-            error_message = (f"コンパイルは成功しましたが、PDFファイル名の取得に失敗しました。\n--- STDOUT ---\n{result.stdout}\n--- STDERR ---\n{result.stderr}")
+        # 正規表現ではなく find で目印の文字列を探す。ログ全体はデコードせず、
+        # 末尾のバイト列からPDF名の部分だけをデコードする
+        tail = result.stdout[-STDOUT_TAIL_SIZE:]
+        start = tail.find(PDF_MESSAGE_PREFIX)
+        end = tail.find(PDF_MESSAGE_SUFFIX, start) if start >= 0 else -1
+        if start < 0 or end < 0:
+            error_message = (f"コンパイルは成功しましたが、PDFファイル名の取得に失敗しました。\n--- STDOUT ---\n{result.stdout.decode('utf-8', 'replace')}\n--- STDERR ---\n{result.stderr.decode('utf-8', 'replace')}")
             raise LocalCompilationException(error_message)
-        pdf_filename = match.group(1)
+        pdf_filename = tail[start + len(PDF_MESSAGE_PREFIX):end].decode("utf-8")
         pdf_path = os.path.join(temp_dir, pdf_filename)
         if not os.path.exists(pdf_path):
             raise LocalCompilationException(f"生成されたはずのPDFファイルが見つかりません: {pdf_path}")
+        if os.path.getsize(pdf_path) == 0:
+            raise LocalCompilationException(f"生成されたPDFファイルが空です: {pdf_path}")
+        # PDF全体をヒープに読み込まずにマップする。POSIX では一時ディレクトリが削除されて
+        # ファイルが unlink されても、マップした内容は mmap を閉じるまで読める。Windows では
+        # マップ中のファイルを削除できず一時ディレクトリの削除に失敗するので、メモリに読み込む
         with open(pdf_path, "rb") as f:
-            pdf_bytes = f.read()
-        print(f"コンパイル成功: {pdf_filename} ({len(pdf_bytes)} bytes)")
-        return (pdf_filename, BytesIO(pdf_bytes))
\ No newline at end of file
+            if os.name == "posix":
+                pdf_data: Union[mmap.mmap, BytesIO] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            else:
+                pdf_data = BytesIO(f.read())
+        logger.info("コンパイル成功: %s (%d bytes)", pdf_filename, os.path.getsize(pdf_path))
+        return (pdf_filename, pdf_data)
\ No newline at end of file
@@ -0,0 +1,280 @@
+import base64
+import io
+import json
+
+import pytest
+
+import texcompile.client as client
+from texcompile.client import ServerConnectionException
+
+RESULT = {
+    "success": True,
+    "has_output": True,
+    "log": "Successfully compiled the TeX",
+    "main_tex_files": ["main.tex"],
+}
+PDF_CONTENTS = b"%PDF-1.5\r\n\x00\xff" * 100
+PS_CONTENTS = b"%!PS"
+
+
+class ChunkedReader:
+    """
+    Stands in for 'response.raw', returning at most 'chunk_size' bytes per read like a
+    chunked HTTP body.
+    """
+
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.decode_content = False
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.body)
+        size = min(size, self.chunk_size)
+        chunk = self.body[self.position : self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+class FakeResponse:
+    def __init__(
+        self, body, content_type, content_length=True, chunk_size=7, status_code=200, headers=()
+    ):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {"Content-Type": content_type, **dict(headers)}
+        if content_length:
+            self.headers["Content-Length"] = str(len(body))
+        self.raw = ChunkedReader(body, chunk_size)
+        self.url = "http://127.0.0.1:8000/"
+        self.closed = False
+
+    @property
+    def content(self):
+        return b"".join(iter(lambda: self.raw.read(), b""))
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def json_body(result=RESULT, **extra):
+    body = dict(result)
+    body["output"] = [
+        {"type": "ps", "path": "main.ps", "contents": base64.b64encode(PS_CONTENTS).decode()},
+        {"type": "pdf", "path": "main.pdf", "contents": base64.b64encode(PDF_CONTENTS).decode()},
+    ]
+    body.update(extra)
+    return json.dumps(body).encode("utf-8")
+
+
+def multipart_body():
+    boundary = "b0undary"
+    metadata = dict(RESULT)
+    metadata["output"] = [{"type": "ps", "path": "main.ps"}, {"type": "pdf", "path": "main.pdf"}]
+    body = b"".join(
+        [
+            b"--b0undary\r\nContent-Type: application/json\r\n\r\n",
+            json.dumps(metadata).encode("utf-8"),
+            b"\r\n--b0undary\r\nContent-Type: application/postscript\r\n\r\n",
+            PS_CONTENTS,
+            b"\r\n--b0undary\r\nContent-Type: application/pdf\r\n\r\n",
+            PDF_CONTENTS,
+            b"\r\n--b0undary--\r\n",
+        ]
+    )
+    return body, f"multipart/mixed; boundary={boundary}"
+
+
+def check_result(data, outputs):
+    assert data == RESULT
+    outputs = list(outputs)
+    assert [(o["type"], o["path"]) for o in outputs] == [("ps", "main.ps"), ("pdf", "main.pdf")]
+    assert client._decode_contents(outputs[0]["contents"]) == PS_CONTENTS
+    assert client._decode_contents(outputs[1]["contents"]) == PDF_CONTENTS
+
+
+def test_read_buffered_json_result():
+    response = FakeResponse(json_body(), "application/json")
+    check_result(*client._read_result(response))
+
+
+def test_read_streamed_json_result():
+    response = FakeResponse(json_body(), "application/json", content_length=False)
+    check_result(*client._read_result(response))
+
+
+def test_read_streamed_json_result_with_nested_fields():
+    result = dict(RESULT, main_tex_files=["main.tex", "appendix.tex"])
+    body = json_body(result)
+    response = FakeResponse(body, "application/json", content_length=False)
+    data, outputs = client._read_result(response)
+    assert data["main_tex_files"] == ["main.tex", "appendix.tex"]
+    assert len(list(outputs)) == 2
+
+
+def test_read_multipart_result():
+    body, content_type = multipart_body()
+    check_result(*client._read_result(FakeResponse(body, content_type)))
+
+
+def test_multipart_result_with_missing_parts():
+    body, content_type = multipart_body()
+    # Drop the last (PDF) part, keeping the closing delimiter.
+    body = body[: body.rindex(b"\r\n--b0undary\r\n")] + b"\r\n--b0undary--\r\n"
+    with pytest.raises(ServerConnectionException, match="1 file parts for 2 outputs"):
+        client._read_result(FakeResponse(body, content_type))
+
+
+def test_streamed_json_result_with_fields_after_output():
+    result = {key: value for key, value in RESULT.items() if key != "log"}
+    body = json_body(result, log="...")
+    response = FakeResponse(body, "application/json", content_length=False)
+    with pytest.raises(ServerConnectionException, match='missing log before "output"'):
+        client._read_result(response)
+
+
+def test_buffered_json_result_with_missing_fields():
+    result = {key: value for key, value in RESULT.items() if key != "log"}
+    response = FakeResponse(json_body(result), "application/json")
+    with pytest.raises(ServerConnectionException, match="missing log") as exc_info:
+        client._read_result(response)
+    assert "before" not in str(exc_info.value)
+
+
+def test_compile_pdf_return_bytes(monkeypatch):
+    response = FakeResponse(json_body(), "application/json", content_length=False)
+    monkeypatch.setattr(client, "send_request", lambda *args, **kwargs: response)
+    basename, contents = client.compile_pdf_return_bytes("sources")
+    assert basename == "main.pdf"
+    assert contents.read() == PDF_CONTENTS
+    assert response.closed
+
+
+def test_compile_pdf(monkeypatch, tmp_path):
+    body, content_type = multipart_body()
+    response = FakeResponse(body, content_type)
+    monkeypatch.setattr(client, "send_request", lambda *args, **kwargs: response)
+    result = client.compile_pdf("sources", str(tmp_path))
+    assert [f.name for f in result.output_files] == ["main.ps", "main.pdf"]
+    assert (tmp_path / "main.pdf").read_bytes() == PDF_CONTENTS
+
+
+def test_compile_pdf_batch(monkeypatch, tmp_path):
+    def compile_pdf(sources_dir, output_dir, host, port):
+        if sources_dir == "broken":
+            raise client.CompilationException("! Emergency stop.")
+        return client.Result(True, ["main.tex"], "", [client.OutputFile("pdf", output_dir)])
+
+    monkeypatch.setattr(client, "compile_pdf", compile_pdf)
+    output_dirs = [str(tmp_path / name) for name in ("a", "b", "c")]
+    results = client.compile_pdf_batch(["a", "broken", "c"], output_dirs)
+
+    assert results[0].output_files[0].name == output_dirs[0]
+    assert isinstance(results[1], client.CompilationException)
+    assert results[2].output_files[0].name == output_dirs[2]
+
+
+def test_compile_pdf_batch_rejects_shared_output_dir(tmp_path):
+    with pytest.raises(ValueError):
+        client.compile_pdf_batch(["a", "b"], [str(tmp_path), str(tmp_path)])
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.archive_names = []
+        self.archive_positions = []
+
+    def post(self, endpoint, files, **kwargs):
+        archive_name, archive_buffer, _ = files["sources"]
+        self.archive_names.append(archive_name)
+        self.archive_positions.append(archive_buffer.tell())
+        # Consume the upload like requests does.
+        archive_buffer.read()
+        return self.responses.pop(0)
+
+
+def test_send_request_retries_104(monkeypatch, tmp_path):
+    (tmp_path / "main.tex").write_text("\\documentclass{article}")
+    session = FakeSession(
+        [FakeResponse(b"", "text/plain", status_code=104)] * client.MAX_REQUEST_ATTEMPTS
+    )
+    delays = []
+    monkeypatch.setattr(client, "_get_session", lambda: session)
+    monkeypatch.setattr(client.time, "sleep", delays.append)
+
+    with pytest.raises(ServerConnectionException, match="attempts"):
+        client.send_request(str(tmp_path), "http://texcompile.example", 80, "autotex")
+
+    # Every attempt uploads the whole archive, with a backoff between attempts.
+    assert session.archive_positions == [0] * client.MAX_REQUEST_ATTEMPTS
+    assert len(delays) == client.MAX_REQUEST_ATTEMPTS - 1
+
+
+def test_send_request_negotiates_zstd(monkeypatch, tmp_path):
+    pytest.importorskip("zstandard")
+    (tmp_path / "main.tex").write_text("\\documentclass{article}")
+    formats = {client.ARCHIVE_FORMATS_HEADER: "tar, gz, zst"}
+    session = FakeSession(
+        [
+            FakeResponse(json_body(), "application/json", headers=formats),
+            FakeResponse(b"", "application/json", status_code=415),
+            FakeResponse(json_body(), "application/json"),
+            FakeResponse(json_body(), "application/json"),
+        ]
+    )
+    monkeypatch.setattr(client, "_get_session", lambda: session)
+    monkeypatch.setattr(client, "_endpoint_archive_formats", {})
+
+    for _ in range(3):
+        client.send_request(str(tmp_path), "http://texcompile.example", 80, "autotex")
+
+    # gzip until the server advertises zstd; gzip again after it rejects a zstd upload.
+    assert session.archive_names == [
+        "archive.tgz", "archive.tar.zst", "archive.tgz", "archive.tgz"
+    ]
+
+
+def test_send_request_negotiates_loopback_tar(monkeypatch, tmp_path):
+    (tmp_path / "main.tex").write_text("\\documentclass{article}")
+    session = FakeSession(
+        [
+            FakeResponse(json_body(), "application/json"),
+            FakeResponse(json_body(), "application/json"),
+            FakeResponse(
+                json_body(), "application/json", headers={client.ARCHIVE_FORMATS_HEADER: "tar, gz"}
+            ),
+            FakeResponse(json_body(), "application/json"),
+        ]
+    )
+    monkeypatch.setattr(client, "_get_session", lambda: session)
+    monkeypatch.setattr(client, "_endpoint_archive_formats", {})
+
+    for _ in range(4):
+        client.send_request(str(tmp_path), "http://localhost", 8000, "autotex")
+
+    # gzip even over loopback until the server advertises uncompressed tarballs, which old
+    # service images cannot read.
+    assert session.archive_names == [
+        "archive.tgz", "archive.tgz", "archive.tgz", "archive.tar"
+    ]
+
+
+def test_read_result_without_optional_modules(monkeypatch):
+    monkeypatch.setattr(client, "_optional_module", lambda name: None)
+    monkeypatch.setattr(client, "_B64_CHUNK_SIZE", 8)
+    response = FakeResponse(json_body(), "application/json")
+    data, outputs = client._read_result(response)
+    pdf_output = list(outputs)[1]
+    assert client._decode_contents(pdf_output["contents"]) == PDF_CONTENTS
+    written = io.BytesIO()
+    client._write_contents(pdf_output["contents"], written)
+    assert written.getvalue() == PDF_CONTENTS
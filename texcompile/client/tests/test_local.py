@@ -0,0 +1,64 @@
+import os
+import stat
+
+import pytest
+
+import texcompile.client.local as local
+from texcompile.client.local import LocalCompilationException
+
+
+def make_tree(root):
+    (root / "figures").mkdir(parents=True)
+    (root / "main.tex").write_text("\\documentclass{article}")
+    (root / "figures" / "plot.pdf").write_bytes(b"%PDF-1.5\r\n\x00\xff")
+    os.chmod(root / "main.tex", 0o644)
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_clone_tree(tmp_path):
+    src = tmp_path / "src"
+    make_tree(src)
+    dst = tmp_path / "dst"
+    dst.mkdir()
+
+    local._clone_tree(str(src), str(dst))
+
+    assert (dst / "main.tex").read_text() == "\\documentclass{article}"
+    assert (dst / "figures" / "plot.pdf").read_bytes() == b"%PDF-1.5\r\n\x00\xff"
+    for path in [dst / "main.tex", dst / "figures", dst / "figures" / "plot.pdf"]:
+        assert mode(path) == local.COMPILATION_PERMISSIONS
+    # The sources themselves are left alone.
+    assert mode(src / "main.tex") == 0o644
+
+
+def test_fast_clone_falls_back_after_partial_copy_file_range(monkeypatch, tmp_path):
+    src = tmp_path / "src.pdf"
+    src.write_bytes(b"0123456789" * 100)
+    dst = tmp_path / "dst.pdf"
+
+    def failing_copy_file_range(src_fd, dst_fd, count, *args):
+        os.write(dst_fd, os.read(src_fd, 10))
+        raise OSError("copy_file_range is not supported here")
+
+    monkeypatch.setattr(local, "fcntl", None)
+    monkeypatch.setattr(local.os, "copy_file_range", failing_copy_file_range, raising=False)
+
+    local._fast_clone(str(src), str(dst))
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_clone_tree_wraps_chmod_errors(monkeypatch, tmp_path):
+    src = tmp_path / "src"
+    make_tree(src)
+    dst = tmp_path / "dst"
+    dst.mkdir()
+
+    def failing_chmod(path, mode):
+        raise PermissionError("Operation not permitted")
+
+    monkeypatch.setattr(local.os, "chmod", failing_chmod)
+    with pytest.raises(LocalCompilationException, match="Operation not permitted"):
+        local._clone_tree(str(src), str(dst))
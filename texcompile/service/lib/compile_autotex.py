@@ -59,6 +59,7 @@ def compile_autotex(
     texlive_path: Path,
     system_path: Path,
     perl_binary: Path,
+    encode_contents: bool = True,
 ) -> Dict[str, Any]:
     if os.path.exists('/tmpfs'):
         tmp_path = '/tmpfs/'
@@ -98,7 +99,10 @@ def compile_autotex(
             output = {
                 "type": output_file.output_type,
                 "path": output_file.path,
-                "contents": base64.b64encode(contents).decode(),
+                # Raw bytes are kept for multipart responses (see lib/multipart.py).
+                "contents": (
+                    base64.b64encode(contents).decode() if encode_contents else contents
+                ),
             }
             json_result["output"].append(output)
 
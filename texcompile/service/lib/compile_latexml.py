@@ -50,7 +50,8 @@ class CompilationResult:
 
 def compile_latexml(
     compressed_sources_file: str,
-    main_tex_file: str
+    main_tex_file: str,
+    encode_contents: bool = True,
 ) -> Dict[str, Any]:
     if os.path.exists('/tmpfs'):
         tmp_path = '/tmpfs/'
@@ -90,7 +91,10 @@ def compile_latexml(
             output = {
                 "type": output_file.output_type,
                 "path": output_file.path,
-                "contents": base64.b64encode(contents).decode(),
+                # Raw bytes are kept for multipart responses (see lib/multipart.py).
+                "contents": (
+                    base64.b64encode(contents).decode() if encode_contents else contents
+                ),
             }
             json_result["output"].append(output)
 
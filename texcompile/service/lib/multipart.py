@@ -0,0 +1,52 @@
+import json
+import uuid
+from typing import Any, Dict, List, Tuple
+from urllib.parse import quote
+
+MULTIPART_MEDIA_TYPE = "multipart/mixed"
+
+OUTPUT_MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "ps": "application/postscript",
+    "html": "text/html",
+}
+
+
+def encode_multipart_result(json_result: Dict[str, Any]) -> Tuple[bytes, str]:
+    """
+    Encode a compilation result whose output contents are raw bytes as a 'multipart/mixed' body.
+    The first part is the JSON result without the output contents. It is followed by one part
+    per entry in the result's "output" list, in the same order, holding that file's raw bytes.
+    Returns the body and the value for its Content-Type header.
+
+    The compile_* functions build such a result when called with encode_contents=False. Clients
+    match file parts to "output" entries by position; the filename in each part's
+    Content-Disposition (RFC 2231-encoded, so non-ASCII paths survive) is informational.
+    """
+    boundary = uuid.uuid4().hex
+    delimiter = b"--" + boundary.encode("ascii")
+
+    outputs = json_result["output"]
+    metadata = dict(json_result)
+    metadata["output"] = [
+        {"type": output["type"], "path": output["path"]} for output in outputs
+    ]
+
+    chunks: List[bytes] = [
+        delimiter,
+        b"\r\nContent-Type: application/json\r\n\r\n",
+        json.dumps(metadata).encode("utf-8"),
+    ]
+    for output in outputs:
+        media_type = OUTPUT_MEDIA_TYPES.get(output["type"], "application/octet-stream")
+        filename = quote(output["path"], safe="")
+        chunks += [
+            b"\r\n",
+            delimiter,
+            f"\r\nContent-Type: {media_type}\r\n".encode("utf-8"),
+            f"Content-Disposition: attachment; filename*=UTF-8''{filename}\r\n\r\n".encode("ascii"),
+            output["contents"],
+        ]
+    chunks += [b"\r\n", delimiter, b"--\r\n"]
+
+    return b"".join(chunks), f"{MULTIPART_MEDIA_TYPE}; boundary={boundary}"
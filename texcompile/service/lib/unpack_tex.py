@@ -5,12 +5,27 @@ import shutil
 import tarfile
 from typing import List
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Archive compressions that 'unpack_archive' can read, as advertised to clients.
+SUPPORTED_ARCHIVE_FORMATS = ["tar", "gz"] + (["zst"] if zstandard is not None else [])
+
+
+class UnsupportedArchiveError(Exception):
+    pass
+
 
 def unpack_archive(archive_path: str, dest_dir: str) -> None:
     """
     For permissible arXiv source formats, see the 'Other formats' page for an arXiv paper.
     At the time of writing, the sources could be any of the following:
-    * If multiple files, a gzipped tar
+    * If multiple files, a gzipped tar (the compilation client may also send an uncompressed or
+      zstd-compressed tar)
     * A PDF
     * A gzipped TeX, DVI, PostScript, or DVI file
     """
@@ -19,11 +34,14 @@ def unpack_archive(archive_path: str, dest_dir: str) -> None:
     if os.listdir(dest_dir):
         logging.warning("Files found in %s. Old files may be overwritten.", dest_dir)
 
+    archive_path = _decompress_zstd(archive_path)
+
     # TODO(andrewhead): Check with Kyle and Sam about how to best handle sandboxing, in case our
     # archive-checking code misses some corner cases. The AutoTeX documentation implies that arXiv
     # quarantines TeX and the compilation process using chroot.
     try:
-        with tarfile.open(archive_path, mode="r:gz") as archive:
+        # Clients may upload either gzipped or uncompressed tarballs.
+        with tarfile.open(archive_path, mode="r:*") as archive:
             archive.extractall(dest_dir, members=get_safe_files(archive, dest_dir))
             logging.debug("Unpacked %s as a tar archive", archive_path)
         return
@@ -45,6 +63,27 @@ def unpack_archive(archive_path: str, dest_dir: str) -> None:
     shutil.copyfile(archive_path, pdf_path)
 
 
+def _decompress_zstd(archive_path: str) -> str:
+    """
+    Decompress a zstd-compressed archive (as uploaded by the compilation client) next to the
+    original. Returns the path of the decompressed file, or the original path if the file is not
+    zstd-compressed.
+    """
+    with open(archive_path, "rb") as archive_file:
+        if archive_file.read(len(ZSTD_MAGIC)) != ZSTD_MAGIC:
+            return archive_path
+        if zstandard is None:
+            raise UnsupportedArchiveError(
+                "Received a zstd-compressed archive, but 'zstandard' is not installed."
+            )
+        archive_file.seek(0)
+        decompressed_path = archive_path + ".tar"
+        with open(decompressed_path, "wb") as decompressed_file:
+            zstandard.ZstdDecompressor().copy_stream(archive_file, decompressed_file)
+    logging.debug("Decompressed zstd archive %s", archive_path)
+    return decompressed_path
+
+
 def _is_file_type_forbidden(tarinfo: tarfile.TarInfo) -> bool:
     return (
         tarinfo.islnk()
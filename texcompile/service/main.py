@@ -4,20 +4,31 @@ from configparser import ConfigParser
 
 import aiofiles
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, Form, Header, HTTPException, Response, UploadFile
 
 from lib.compile_autotex import compile_autotex
 from lib.compile_latexml import compile_latexml
+from lib.multipart import MULTIPART_MEDIA_TYPE, encode_multipart_result
+from lib.unpack_tex import SUPPORTED_ARCHIVE_FORMATS, UnsupportedArchiveError
 
 app = FastAPI()
 
+# Tells clients which archive compressions they may upload (e.g., zstd) in later requests.
+ARCHIVE_FORMATS_HEADER = "X-Texcompile-Archive-Formats"
+
 
 @app.post("/")
 async def detect_upload_file(
+        response: Response,
         sources: UploadFile = File(...), 
         autotex_or_latexml: str = Form(...),
-        main_tex_file: str = Form(...)
+        main_tex_file: str = Form(...),
+        accept: str = Header("application/json"),
     ):
+    headers = {ARCHIVE_FORMATS_HEADER: ", ".join(SUPPORTED_ARCHIVE_FORMATS)}
+    # Clients that accept 'multipart/mixed' get output files as raw binary parts instead of
+    # base64 strings embedded in the JSON result.
+    binary_output = MULTIPART_MEDIA_TYPE in accept
 
     config = ConfigParser()
     config.read("service_config.ini")
@@ -31,18 +42,27 @@ async def detect_upload_file(
         async with aiofiles.open(sources_filename, "wb") as sources_file:
             content = await sources.read()  # async read
             await sources_file.write(content)  # async write
-        if autotex_or_latexml == "autotex":
-            json_result = compile_autotex(
-                sources_filename, texlive_path, system_path, perl_binary
-            )
-            return json_result
-        elif autotex_or_latexml == "latexml":
-            json_result = compile_latexml(
-                sources_filename, main_tex_file
-            )
-            return json_result
-        else:
-            pass
+        try:
+            if autotex_or_latexml == "autotex":
+                json_result = compile_autotex(
+                    sources_filename, texlive_path, system_path, perl_binary,
+                    encode_contents=not binary_output,
+                )
+            elif autotex_or_latexml == "latexml":
+                json_result = compile_latexml(
+                    sources_filename, main_tex_file, encode_contents=not binary_output
+                )
+            else:
+                return
+        except UnsupportedArchiveError as e:
+            # Lets the client retry with a format it knows we can read.
+            raise HTTPException(status_code=415, detail=str(e), headers=headers)
+
+    if binary_output:
+        body, content_type = encode_multipart_result(json_result)
+        return Response(content=body, media_type=content_type, headers=headers)
+    response.headers.update(headers)
+    return json_result
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+import email
+import json
+
+from lib.multipart import encode_multipart_result
+
+
+def test_encode_multipart_result():
+    json_result = {
+        "success": True,
+        "has_output": True,
+        "log": "...",
+        "main_tex_files": ["main.tex"],
+        "output": [
+            {"type": "pdf", "path": "main.pdf", "contents": b"%PDF-1.5\r\n\x00\xff"},
+            {"type": "ps", "path": "図/main.ps", "contents": b"%!PS"},
+        ],
+    }
+    body, content_type = encode_multipart_result(json_result)
+    assert content_type.startswith("multipart/mixed; boundary=")
+
+    message = email.message_from_bytes(
+        b"Content-Type: " + content_type.encode("ascii") + b"\r\n\r\n" + body
+    )
+    parts = message.get_payload()
+    assert len(parts) == 3
+
+    metadata = json.loads(parts[0].get_payload())
+    assert metadata["success"] is True
+    assert metadata["output"] == [
+        {"type": "pdf", "path": "main.pdf"},
+        {"type": "ps", "path": "図/main.ps"},
+    ]
+
+    assert parts[1].get_content_type() == "application/pdf"
+    assert parts[1].get_filename() == "main.pdf"
+    assert parts[1].get_payload(decode=True) == b"%PDF-1.5\r\n\x00\xff"
+    assert parts[2].get_filename() == "図/main.ps"
+    assert parts[2].get_payload(decode=True) == b"%!PS"
@@ -0,0 +1,39 @@
+import os.path
+import tarfile
+
+import pytest
+
+from lib.unpack_tex import unpack_archive
+
+
+@pytest.mark.parametrize("mode", ["w", "w:gz"])
+def test_unpack_tar_archive(tmp_path, mode):
+    sources_dir = tmp_path / "sources"
+    sources_dir.mkdir()
+    (sources_dir / "main.tex").write_text("\\documentclass{article}")
+
+    archive_path = str(tmp_path / "archive")
+    with tarfile.open(archive_path, mode) as archive:
+        archive.add(str(sources_dir), arcname=os.path.sep)
+
+    dest_dir = tmp_path / "dest"
+    unpack_archive(archive_path, str(dest_dir))
+    assert (dest_dir / "main.tex").read_text() == "\\documentclass{article}"
+
+
+def test_unpack_zstd_tar_archive(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    sources_dir = tmp_path / "sources"
+    sources_dir.mkdir()
+    (sources_dir / "main.tex").write_text("\\documentclass{article}")
+
+    tar_path = str(tmp_path / "archive.tar")
+    with tarfile.open(tar_path, "w") as archive:
+        archive.add(str(sources_dir), arcname=os.path.sep)
+    archive_path = str(tmp_path / "archive")
+    with open(tar_path, "rb") as tar_file, open(archive_path, "wb") as archive_file:
+        zstandard.ZstdCompressor().copy_stream(tar_file, archive_file)
+
+    dest_dir = tmp_path / "dest"
+    unpack_archive(archive_path, str(dest_dir))
+    assert (dest_dir / "main.tex").read_text() == "\\documentclass{article}"